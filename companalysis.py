@@ -3,26 +3,75 @@
 import pandas as pd
 import time
 import re
+import csv
+import logging
+import functools
 import numpy as np
-from tqdm import tqdm
+from tqdm.auto import tqdm
 import requests
 import os
+import atexit
+import tempfile
+import hashlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from collections import defaultdict
 from datetime import datetime, timedelta
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
+# Optional: psutil lets the product scraper limit its workers to the memory available
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
 # Selenium packages
 from selenium import webdriver
 from selenium.webdriver import ActionChains
 from selenium.webdriver.common.actions.wheel_input import ScrollOrigin
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-
-# Dask packages
-from dask import delayed, compute
-from dask.diagnostics import ProgressBar
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+# Optional: webdriver_manager downloads a chromedriver, otherwise Selenium Manager (built into Selenium 4.20+) finds one
+try:
+    from webdriver_manager.chrome import ChromeDriverManager
+except ImportError:
+    ChromeDriverManager = None
+
+# Regular expressions
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,4}")
+PRICE_RE = re.compile(r"^(USD ?|\$ ?|MX\$ ?)\d+\.\d{2}$")
+PRICE_PREFIX_RE = re.compile(r"^(USD|\$|MX\$) ?")
+REVIEW_RE = re.compile(r"^(?P<pct>\d+)% \((?P<n>\d[\d,]*)\)")
+CALORIES_RE = re.compile(r"^(?P<cal>\d[\d,]*)\s*Cal", re.IGNORECASE)
+PARENTHESES_RE = re.compile(r"[()]")
+PLACE_ID_RE = re.compile(r"!19s([^!?&/]+)")
+
+# Selenium locators for the product scraper
+COMBOBOX_LOC = (By.XPATH, '//*[@role="combobox"]')
+OPTION_LOC = (By.XPATH, '//*[@role="option"]')
+STORE_CARD_LOC = (By.XPATH, '//a[@data-testid="store-card"]')
+RESTAURANT_TAB_LOC = (By.XPATH, "//li[normalize-space(.)='Restaurants' or normalize-space(.)='Restaurantes']")
+
+# Seconds between checks of a wait condition, shorter than Selenium's default 0.5 so waits end closer to when the page is ready
+WAIT_POLL_FREQUENCY = 0.1
+
+# Get the website URL for the product scraper from the environment variables
+# NOTE: You need to set the WEBSITE_URL environment variable to the website you want to scrape. 
+# To do this create a .env file in the same directory as this script and add the line:
+# WEBSITE_URL="https://www.yourwebsite.com"
+load_dotenv()
+WEBSITE_URL = os.getenv("WEBSITE_URL")
+
+# Logger for debug information, only formatted when its level is enabled
+log = logging.getLogger(__name__)
 
 
 ############################################################################################################
@@ -41,73 +90,181 @@ Ex. Find the price, rating, and calories of Churros in New York City.
 """
 
 
+############################################################################################################
+# Browser Setup
+
+
+# Helper Function: Create a chromedriver service that has not been started yet
+def chromedriver_service():
+    """Helper Function: Create a chromedriver service that has not been started yet, with the driver from webdriver_manager if it is installed."""
+    if ChromeDriverManager is not None:
+        return Service(ChromeDriverManager().install())
+    return Service()  # The driver is found by Selenium Manager
+
+
+# Helper Function: Start the chromedriver service shared by every browser in this process
+@functools.lru_cache(maxsize=None)
+def get_chromedriver_service():
+    """Helper Function: Start the chromedriver service shared by every browser in this process.
+    
+    The service is started on first use rather than at import so that processes which never
+    open a browser do not launch chromedriver, and it is stopped when the process exits.
+    """
+    service = chromedriver_service()
+    if service.path is None:
+        from selenium.webdriver.common.driver_finder import DriverFinder
+        service.path = DriverFinder(service, Options()).get_driver_path()
+    service.start()
+    atexit.register(service.stop)
+    return service
+
+
+# User agent of a regular desktop Chrome, since headless Chrome's own user agent gets slower, heavier pages on some sites
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+
+# Helper Function: Build Chrome options that skip the page content and browser features the scrapers do not use
+def chrome_options(headless, prefs=None, user_data_dir=None):
+    """Helper Function: Build Chrome options that skip the page content and browser features the scrapers do not use.
+    
+    Args:
+        headless (bool): Whether to run the browser in headless mode.
+        prefs (dict): Extra Chrome preferences, such as language settings. Default is None.
+        user_data_dir (str): Directory of a Chrome profile to keep between runs. Default is None, a new temporary profile.
+        
+    Returns:
+        Options: The Chrome options.
+    """
+    options = Options()
+    options.add_experimental_option('prefs', {
+        'profile.managed_default_content_settings.images': 2,  # Do not download images
+        'profile.default_content_setting_values.notifications': 2,  # Block notification prompts
+        **(prefs or {})
+    })
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-background-networking")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--force-prefers-reduced-motion")  # Ask pages to skip CSS animations
+    options.add_argument("--autoplay-policy=user-gesture-required")  # Do not start videos
+    options.add_argument("--mute-audio")
+    options.add_argument(f"user-agent={USER_AGENT}")
+    if user_data_dir:
+        options.add_argument(f"--user-data-dir={user_data_dir}")
+    if headless:
+        options.add_argument("--headless=new")  # The new headless mode runs the full browser, the old one a separate implementation
+    return options
+
+
+# Directory of the Chrome profiles kept between runs, so their disk cache and cookies are already warm
+CHROME_PROFILES_DIR = os.path.join(tempfile.gettempdir(), "comp_analysis_chrome")
+
+
+# Helper Function: Get the directory of the Chrome profile kept for a location
+def chrome_profile_dir(location, headless):
+    """Helper Function: Get the directory of the Chrome profile kept for a location, separate for headless browsers since Chrome locks a profile to one running browser.
+    
+    The readable name is followed by a hash of the exact location, so locations that only differ in case or punctuation get their own profiles.
+    """
+    name = re.sub(r"\W+", "_", location).strip("_").lower() or "default"
+    name = f"{name}_{hashlib.sha1(location.encode('utf-8')).hexdigest()[:8]}"
+    return os.path.join(CHROME_PROFILES_DIR, f"{name}_headless" if headless else name)
+
+
+# Helper Function: Start a new browser session on the shared chromedriver service
+def start_browser(options):
+    """Helper Function: Start a new browser session on the shared chromedriver service."""
+    return webdriver.Remote(get_chromedriver_service().service_url, options=options)
+
+
 ############################################################################################################
 # Maps Scraper
 
 
+# Columns of the DataFrame returned by maps_scraper
+PLACE_COLUMNS = ['Search Query', 'Location', 'Name', 'Description', 'Stars (out of 5)', 'Number of Reviews', 'Address', 'Phone', 'Emails', 'Website', 'Price Range']
+
+# Fields of a place's header for each number of lines it can have
+HEADER_SHAPES = {
+    5: ('name', 'stars', 'reviews', 'price', 'description'),  # If there are reviews and a price range
+    4: ('name', 'stars', 'reviews', 'description'),  # If there are reviews but no price range
+    2: ('name', 'description'),  # If there are no reviews
+    1: ('name',),  # Edge case with an empty string
+}
+
+# JavaScript to read a place's header and info buttons in a single round trip to the browser
+PLACE_INFO_JS = """
+const header = document.getElementsByClassName('lMbq3e')[0];
+return {
+    header: header ? header.innerText.trim() : '',
+    info: Array.from(document.getElementsByClassName('CsEnBe')).map(e => ({
+        aria: e.getAttribute('aria-label'),
+        text: e.innerText.trim(),
+        href: e.href || e.getAttribute('href')
+    }))
+};
+"""
+
+
+# Domains of social media and delivery sites, which never list a place's own email so are not worth loading
+NON_EMAIL_DOMAINS = ('facebook.com', 'instagram.com', 'ubereats.com', 'doordash.com', 'grubhub.com', 'yelp.com')
+
+
+# Helper Function: Check if a website could list the place's own emails
+def may_have_emails(website_url):
+    """Helper Function: Check if a website could list the place's own emails."""
+    domain = urlparse(website_url).netloc.lower()
+    return not any(domain == d or domain.endswith('.' + d) for d in NON_EMAIL_DOMAINS)
+
+
 # Helper Function: Extract emails from a website
 def extract_emails(browser, website_url):
     """Helper Function: Extract emails from a website using regular expressions."""
     browser.get(website_url)
     
-    # Get the regular expressions pattern to match on
-    email_pattern = r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,4}"
     # Get the html content for the page
     html = browser.page_source
     # Get a list of emails
-    emails = re.findall(email_pattern, html)
-    # Get a unique array of the emails on the page
-    unique_emails_arr = pd.DataFrame(columns=['email'],data=emails)['email'].unique()
-    # Convert to string with a comma delimiting them
-    unique_emails_str = ','.join(unique_emails_arr)
+    emails = EMAIL_RE.findall(html)
+    # Convert the unique emails, in the order found, to a string with a comma delimiting them
+    unique_emails_str = ','.join(dict.fromkeys(emails))
     return unique_emails_str
 
 
 # Helper Function: Inner function to extract information about a specific place from its page
-def extract_place_info(browser, place_url, location, search_query, all_addresses, all_place_names, debug_mode):
+def extract_place_info(browser, place_url, location, search_query, all_seen, seen_lock, debug_mode):
     """Helper Function: Extract information about a specific place from its page."""
     wait = WebDriverWait(browser, 10)
     browser.get(place_url)
     wait.until(EC.presence_of_element_located((By.CLASS_NAME, "lMbq3e")))
             
+    # Read the header and the info buttons about the place all at once
+    place_page = browser.execute_script(PLACE_INFO_JS)
+    
     # Extract the header information about the place
-    header_text = browser.find_element(By.CLASS_NAME,'lMbq3e').text
+    header_text = place_page['header']
     header_list = header_text.split("\n")
     
     # Do not include locations that are temporarily closed
     if 'Temporarily closed' in header_list or 'Cerrado temporalmente' in header_list:
         return "skip"
     
-    if len(header_list) == 4:  # If there are reviews but no price range
-        place_name = header_list[0]
-        reviews_stars = header_list[1]
-        num_of_reviews = header_list[2].strip('(').strip(')')
-        price_range = None
-        place_description = header_list[3]
-    elif len(header_list) == 5:  # If there are reviews and a price range
-        place_name = header_list[0]
-        reviews_stars = header_list[1]
-        num_of_reviews = header_list[2].strip('(').strip(')')
-        price_range = header_list[3]
-        place_description = header_list[4]
-    elif len(header_list) == 2:  # If there are no reviews
-        place_name = header_list[0]
-        reviews_stars = None
-        num_of_reviews = None
-        price_range = None
-        place_description = header_list[1]
-    elif len(header_list) == 1:  # Edge case with an empty string
-        place_name = header_list[0]
-        reviews_stars = None
-        num_of_reviews = None
-        price_range = None
-        place_description = None
-    else:
+    header_shape = HEADER_SHAPES.get(len(header_list))
+    if header_shape is None:
         print(f"Error extracting header information {header_list} for place with URL: {place_url}")
         return "skip"
     
+    header = dict(zip(header_shape, header_list))
+    place_name = header['name']
+    reviews_stars = header.get('stars')
+    num_of_reviews = PARENTHESES_RE.sub('', header['reviews']) if 'reviews' in header else None
+    price_range = header.get('price')
+    place_description = header.get('description')
+    
     # Extract additional information like address, phone, and website
-    info_elements = browser.find_elements(By.CLASS_NAME, "CsEnBe")
+    info_elements = place_page['info']
     website = None
     phone = None
     address = None
@@ -116,28 +273,27 @@ def extract_place_info(browser, place_url, location, search_query, all_addresses
     # TODO: Find a way to make this robust against locale differences
     # Check for both English and Spanish labels
     for info_element in info_elements:
-        aria_label = info_element.get_attribute("aria-label")
+        aria_label = info_element['aria']
         if aria_label:
             if 'Address:' in aria_label or 'Dirección:' in aria_label:
-                address = info_element.text.split('\n')[1] if '\n' in info_element.text else info_element.text
+                address = info_element['text'].split('\n')[1] if '\n' in info_element['text'] else info_element['text']
             if 'Phone:' in aria_label or 'Teléfono:' in aria_label:
-                phone = info_element.text
+                phone = info_element['text']
             if 'Website:' in aria_label or 'Sitio web:' in aria_label:
-                website = info_element.get_attribute("href")
+                website = info_element['href']
     
-    # Check if the place is a duplicate
-    if address in all_addresses:
-        if place_name in all_place_names:
+    # Check if the place is a duplicate (the set is shared across worker threads)
+    key = (address, place_name)
+    with seen_lock:
+        if key in all_seen:
             return "skip"
-    else:
-        all_addresses.append(address)
-        all_place_names.append(place_name)
+        all_seen.add(key)
     
-    if website is not None:
+    if website is not None and may_have_emails(website):
         emails = extract_emails(browser, website)
     
-    # Compile the extracted information into a list
-    place_info = [
+    # Compile the extracted information into a dict keyed by column
+    place_info = dict(zip(PLACE_COLUMNS, (
         search_query,
         location,
         place_name,
@@ -149,7 +305,7 @@ def extract_place_info(browser, place_url, location, search_query, all_addresses
         emails,
         website,
         price_range
-    ]
+    )))
     
     if debug_mode:
         print(place_info)
@@ -157,8 +313,21 @@ def extract_place_info(browser, place_url, location, search_query, all_addresses
     return place_info
 
 
+# Helper Function: Get the place ID from a maps place URL
+def place_id(place_url):
+    """Helper Function: Get the place ID from a maps place URL, or the URL itself if it does not contain one."""
+    match = PLACE_ID_RE.search(place_url)
+    return match.group(1) if match else place_url
+
+
+# Helper Function: Check if the maps service has shown every search result
+def reached_end_of_list(browser):
+    """Helper Function: Check if the maps service has shown every search result."""
+    return len(browser.find_elements(By.XPATH, "//span[contains(text(), \"You've reached the end of the list\")]")) > 0
+
+
 # Helper Function: Define a function to extract search results for a given search URL, location, and search_query
-def extract_search_results(browser, search_url, location, search_query, max_places_to_find, max_num_scrolls, all_addresses, all_place_names, total_bar, debug_mode, url_update_count):
+def extract_search_results(browser, search_url, location, search_query, max_places_to_find, max_num_scrolls, all_seen, seen_place_ids, seen_lock, total_bar, debug_mode, url_update_count):
     """Helper Function: Extract search results for a given search URL, location, and search query."""
     # Navigate to the search URL
     browser.get(search_url)
@@ -173,17 +342,28 @@ def extract_search_results(browser, search_url, location, search_query, max_plac
     
     # Perform scrolling action to reveal more search results
     for i in range(max_num_scrolls):
+        prev_count = len(browser.find_elements(By.CLASS_NAME, "hfpxzc"))
         ActionChains(browser).scroll_from_origin(scroll_origin, 0, 1500*(i+1)).perform()
 
-        # TODO: Possibly find a way to use selenium WebDriverWait 
-        time.sleep(3)
+        # Wait until more results have loaded or the end of the list is shown
+        try:
+            WebDriverWait(browser, 5).until(
+                lambda d: len(d.find_elements(By.CLASS_NAME, "hfpxzc")) > prev_count or reached_end_of_list(d)
+            )
+        except TimeoutException:
+            pass  # Nothing new loaded, keep the results found so far
+        
+        if reached_end_of_list(browser):  # No more results to reveal
+            total_bar.update(max_num_scrolls - i)
+            break
         total_bar.update(1)  # Explicitly update the progress bar
     
-    # Find all elements that represent places in the search results
-    place_elements = browser.find_elements(By.CLASS_NAME, "hfpxzc")
-        
-    # Extract the URLs of all places
-    place_urls = [element.get_attribute("href") for element in place_elements]
+    # Extract the URLs of all places in the search results in a single round trip to the browser
+    place_urls = browser.execute_script("return Array.from(document.getElementsByClassName('hfpxzc')).map(a => a.href);")
+    
+    # Drop the places that were already opened before navigating to them
+    with seen_lock:
+        place_urls = [url for url in place_urls if place_id(url) not in seen_place_ids]
     
     place_info_list = []
     update_count = 0
@@ -192,13 +372,19 @@ def extract_search_results(browser, search_url, location, search_query, max_plac
     
     # Loop through the URLs to extract information for each place
     for i, url in enumerate(place_urls):
+        with seen_lock:  # Another worker may have opened the place since the URLs were filtered, otherwise claim it
+            url_place_id = place_id(url)
+            if url_place_id in seen_place_ids:
+                continue
+            seen_place_ids.add(url_place_id)
+        
         try: 
             temp_place_info = extract_place_info(browser, 
                                                  url, 
                                                  location, 
                                                  search_query, 
-                                                 all_addresses, 
-                                                 all_place_names, 
+                                                 all_seen, 
+                                                 seen_lock,
                                                  debug_mode)
             
             if temp_place_info == "skip":  # Skip if the place is a duplicate or contains errors
@@ -208,6 +394,8 @@ def extract_search_results(browser, search_url, location, search_query, max_plac
             
         except Exception as e:
             print(f"Error extracting place with url: {url}. Error: {e}")
+            with seen_lock:  # Let a later search retry the place
+                seen_place_ids.discard(url_place_id)
         
         # Stop if max_places_to_find places have been found
         if len(place_info_list) >= max_places_to_find:
@@ -227,6 +415,21 @@ def extract_search_results(browser, search_url, location, search_query, max_plac
     return place_info_list
 
 
+# Helper Function: Clear a pooled browser between searches, replacing it if the driver has crashed
+def reset_browser(browser, options):
+    """Helper Function: Clear a pooled browser between searches, replacing it if the driver has crashed."""
+    try:
+        browser.execute_script("window.stop();")  # Stop any page that is still loading
+        browser.delete_all_cookies()
+        return browser
+    except WebDriverException:
+        try:
+            browser.quit()
+        except WebDriverException:
+            pass
+        return start_browser(options)
+
+
 # Define the main function to scrape a maps service for information about places based on search queries and locations
 def maps_scraper(search_queries, 
                  locations=[''], 
@@ -236,7 +439,8 @@ def maps_scraper(search_queries,
                  export_final_filename=None, 
                  export_by_search_query=False, 
                  debug_mode=False,
-                 url_update_count=3):
+                 url_update_count=3,
+                 pool_size=4):
     """Scrape maps service for information about places based on search queries and locations.
     
     Args:
@@ -249,77 +453,101 @@ def maps_scraper(search_queries,
         export_by_search_query (bool): Whether to export the results to a CSV file for each search query. Default is False.
         debug_mode (bool): Whether to print debug information. Default is False.
         url_update_count (int): The number of times to update the progress bar for each URL. Default is 3.
+        pool_size (int): The number of browsers to run in parallel, one (search query, location) pair each. Default is 4.
         
     Returns:
         pandas.DataFrame: A DataFrame containing the information about the places found.
     """
-    # Prepare to compile information for multiple locations and search_queries
-    final_places_list = []
-    all_addresses = []
-    all_place_names = []
+    # Prepare to compile information for multiple locations and search_queries, one list per column
+    final_places_columns = {column: [] for column in PLACE_COLUMNS}
+    all_seen = set()  # (address, place name) pairs already scraped
+    seen_place_ids = set()  # Place IDs of the place URLs already opened
+    seen_lock = threading.Lock()
 
     # Initialize the WebDriver Options 
-    options = Options()
-    options.add_experimental_option('prefs', {'intl.accept_languages': 'en,en_US'})  # Set language preferences
-    if headless:
-        options.add_argument("--headless")
+    options = chrome_options(headless, {'intl.accept_languages': 'en,en_US'})  # Set language preferences
+
+    pairs = [(search_query, location) for search_query in search_queries for location in locations]
+    pool_size = max(1, min(pool_size, len(pairs)))
 
     with tqdm(total=len(search_queries) * len(locations) * (max_num_scrolls + url_update_count), desc="Total Progress", unit="search") as total_bar:
-        # Loop through each search_query and location, perform searches, and compile results
-        try: 
-            for search_query in search_queries:
-                if debug_mode:
-                    print(search_query)
-                for location in locations:  
-                    # Initialize the WebDriver for Chrome
-                    browser = webdriver.Chrome(options=options)
-                    
-                    try:  # Search the maps service for the search query in the location
-                        if debug_mode:
-                            print(location)
-                        search = f"{search_query} in {location}"
-                        if debug_mode:
-                            print(search)
-                        search_url = f"https://www.google.com/maps/search/{search}"
-                        
-                        combo_place_info_list = extract_search_results(
-                            browser, 
-                            search_url, 
-                            location, 
-                            search_query, 
-                            max_places_to_find, 
-                            max_num_scrolls, 
-                            all_addresses, 
-                            all_place_names,
-                            total_bar,
-                            debug_mode,
-                            url_update_count
-                        )
-                        
-                        if export_by_search_query:  # Export the results to a CSV file for each search query
-                            pd.DataFrame(combo_place_info_list).to_csv(f'{search_query} Export.csv', index=False)
-                            
-                        final_places_list.extend(combo_place_info_list)
-                        
-                    except Exception as e:
-                        print(f"Error extracting search results for {search_query} in {location}: ")
-                        print(e)
-                    
-                    finally:
-                        browser.close()
-                    
-                    total_bar.update(1)  # Explicitly update the progress bar
+        
+        # Search the maps service for the search query in the location
+        def run_pair(search_query, location, browser):
+            if debug_mode:
+                print(search_query)
+                print(location)
+            search = f"{search_query} in {location}"
+            if debug_mode:
+                print(search)
+            search_url = f"https://www.google.com/maps/search/{search}"
+            
+            combo_place_info_list = extract_search_results(
+                browser, 
+                search_url, 
+                location, 
+                search_query, 
+                max_places_to_find, 
+                max_num_scrolls, 
+                all_seen, 
+                seen_place_ids,
+                seen_lock,
+                total_bar,
+                debug_mode,
+                url_update_count
+            )
+            
+            return combo_place_info_list
+        
+        # Check a browser out of the pool for one pair and return it when done
+        def run_pair_from_pool(search_query, location):
+            browser = browser_pool.get()
+            try:
+                return run_pair(search_query, location, browser)
+            except Exception as e:
+                print(f"Error extracting search results for {search_query} in {location}: ")
+                print(e)
+                return []
+            finally:
+                try:
+                    browser = reset_browser(browser, options)
+                finally:  # Always return a browser so the other workers never block on an empty pool
+                    browser_pool.put(browser)
+                total_bar.update(1)  # Explicitly update the progress bar
+        
+        browser_pool = queue.Queue()
+        try:
+            with ThreadPoolExecutor(max_workers=pool_size) as executor:
+                # Pre-warm the pool by starting the browsers in parallel
+                for browser in executor.map(lambda _: start_browser(options), range(pool_size)):
+                    browser_pool.put(browser)
+                
+                # Loop through each search_query and location, perform searches, and compile results
+                futures = [executor.submit(run_pair_from_pool, search_query, location) for search_query, location in pairs]
+                query_places = defaultdict(list)  # Places found for each search query, across its locations
+                for (search_query, _), future in zip(pairs, futures):  # Keep the results in search_query, location order
+                    place_info_list = future.result()
+                    query_places[search_query].extend(place_info_list)
+                    for place_info in place_info_list:
+                        for column, value in place_info.items():
+                            final_places_columns[column].append(value)
+            
+            if export_by_search_query:  # Export the results to a CSV file for each search query, once all its locations are done
+                for search_query, place_info_list in query_places.items():
+                    pd.DataFrame(place_info_list, columns=PLACE_COLUMNS).to_csv(f'{search_query} Export.csv', index=False)
                     
         except Exception as e:
             print(e)
         finally:
-            browser.quit()
+            # Every browser is back in the pool once the executor has finished
+            while not browser_pool.empty():
+                try:
+                    browser_pool.get_nowait().quit()
+                except WebDriverException:
+                    pass
             
-    # Create a DataFrame from the final_places_list
-    places_df = pd.DataFrame(
-        columns=['Search Query', 'Location', 'Name', 'Description', 'Stars (out of 5)', 'Number of Reviews', 'Address', 'Phone', 'Emails','Website', 'Price Range'], 
-        data=final_places_list
-    )
+    # Create a DataFrame from the final_places_columns
+    places_df = pd.DataFrame(final_places_columns, columns=PLACE_COLUMNS)
     
     # Export the final DataFrame to a CSV file
     if export_final_filename:
@@ -335,6 +563,13 @@ def maps_scraper(search_queries,
 # Proximity Competition
 
 
+# The maximum number of Google Maps API requests in flight at once
+MAX_API_REQUESTS = 32
+# Distance Matrix API limits: origins or destinations per request, and origins * destinations per request
+MAX_MATRIX_ADDRESSES = 25
+MAX_MATRIX_ELEMENTS = 100
+
+
 # Helper Function: Get the Unix timestamp for the next 2 a.m. to minimize variance in travel times
 def get_next_2am_unix_timestamp():
     """Get the Unix timestamp for the next 2 a.m. to minimize variance in travel times.
@@ -344,16 +579,53 @@ def get_next_2am_unix_timestamp():
     
     TODO: Make this robust against different timezones.
     """
-    now = datetime.now()
-    next_2am = now.replace(hour=2, minute=0, second=0, microsecond=0)
+    # The next 2 a.m. only changes on the hour, so the result is cached for the current hour
+    current_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+    return next_2am_unix_timestamp_after(current_hour)
+
+
+# Helper Function: Get the Unix timestamp for the first 2 a.m. after the start of an hour
+@functools.lru_cache(maxsize=1)
+def next_2am_unix_timestamp_after(current_hour):
+    """Helper Function: Get the Unix timestamp for the first 2 a.m. after the start of an hour."""
+    next_2am = current_hour.replace(hour=2)
 
     # If it's already past 2 a.m. today, move to the next day
-    if now >= next_2am:
+    if current_hour >= next_2am:
         next_2am += timedelta(days=1)
 
     return int(time.mktime(next_2am.timetuple()))
 
 
+# Helper Function: Request the travel times between a block of origins and destinations from the Google Maps API
+def fetch_distance_matrix(session, base_url, origins, destinations, departure_time, apikey):
+    """Helper Function: Request the travel times between a block of origins and destinations from the Google Maps API."""
+    params = {
+        "origins": "|".join(origins),
+        "destinations": "|".join(destinations),
+        "departure_time": departure_time,  # Dynamically calculated 2 a.m. timestamp
+        "key": apikey
+    }
+    
+    response = session.get(base_url, params=params)
+    if response.status_code != 200:
+        raise Exception(f"Google Maps API error: {response.status_code}")
+    
+    data = response.json()
+    if data["status"] != "OK":
+        raise Exception(f"Google Maps API error: {data['status']}")
+    
+    return data
+
+
+# Helper Function: Check that an argument is a list or numpy array and return it as a numpy array
+def as_1d_array(x, name):
+    """Helper Function: Check that an argument is a list or numpy array and return it as a numpy array without copying arrays."""
+    if not isinstance(x, (list, np.ndarray)):
+        raise TypeError(f"{name} must be a list or numpy array.")
+    return np.asarray(x)
+
+
 # Helper Function: Calculate the travel time to each destination from each origin using the Google Maps API
 def time_to_destinations(origin_addresses: np.ndarray, 
                          origin_names: np.ndarray, 
@@ -372,70 +644,64 @@ def time_to_destinations(origin_addresses: np.ndarray,
     Returns:
         pd.DataFrame: A DataFrame of travel times between origins (rows) and destinations (columns).
     """
+    # Check if the origin and destination addresses and names are provided
+    origin_addresses = as_1d_array(origin_addresses, "origin_addresses")
+    origin_names = as_1d_array(origin_names, "origin_names")
+    destination_addresses = as_1d_array(destination_addresses, "destination_addresses")
+    destination_names = as_1d_array(destination_names, "destination_names")
+    
     n, m = len(origin_addresses), len(destination_addresses)
     times_arr = np.zeros((n, m), dtype=float)
     
-    # Check if the origin and destination addresses are provided
-    if type(origin_addresses) != list and type(origin_addresses) != np.ndarray:
-        raise TypeError("origin_addresses must be a numpy array.")
-    else:
-        destination_addresses = np.array(destination_addresses)
-    if type(destination_addresses) != list and type(destination_addresses) != np.ndarray:
-        raise TypeError("destination_addresses must be a numpy array.")
-    else:
-        destination_addresses = np.array(destination_addresses)
-    if type(origin_addresses) == list:
-        origin_addresses = np.array(origin_addresses)
-    if type(destination_addresses) == list:
-        destination_addresses = np.array(destination_addresses)
-    
-    # Check if the origin and destination names are provided
-    if type(origin_names) != list and type(origin_names) != np.ndarray:
-        raise TypeError("origin_names must be a numpy array.")
-    if type(destination_names) != list and type(destination_names) != np.ndarray:
-        raise TypeError("destination_names must be a numpy array.")
-    if type(origin_names) == np.ndarray:
-        if origin_names.shape != (n,):
-            raise ValueError("origin_names must have the same shape as origin_addresses.")
-    if type(destination_names) == np.ndarray:
-        if destination_names.shape != (m,):
-            raise ValueError("destination_names must have the same shape as destination_addresses.")
-    if len(origin_names) != n or len(destination_names) != m:
-        raise ValueError("The number of origin and destination names must match the number of addresses.")
+    if origin_names.shape != (n,):
+        raise ValueError("origin_names must have the same shape as origin_addresses.")
+    if destination_names.shape != (m,):
+        raise ValueError("destination_names must have the same shape as destination_addresses.")
     
     # Check if the API key is provided
     if not apikey:
         raise ValueError("A Google Maps API key is required to calculate the travel times.")
     
-    # Loop through each origin and destination pair
-    for i, origin in enumerate(origin_addresses):
-        
-        base_url = "https://maps.googleapis.com/maps/api/directions/json"
-
-        # Calculate the Unix timestamp for the next 2 a.m. to minimize variance in travel times
-        departure_time = str(get_next_2am_unix_timestamp())
+    base_url = "https://maps.googleapis.com/maps/api/distancematrix/json"
 
-        for j, destination in enumerate(destination_addresses):
-            params = {
-                "origin": origin,
-                "destination": destination,
-                "departure_time": departure_time,  # Dynamically calculated 2 a.m. timestamp
-                "key": apikey
+    # Calculate the Unix timestamp for the next 2 a.m. to minimize variance in travel times
+    departure_time = str(get_next_2am_unix_timestamp())
+    
+    # Split the addresses into blocks that fit in a single Distance Matrix request
+    origin_step = max(1, min(n, MAX_MATRIX_ADDRESSES))
+    destination_step = max(1, min(m, MAX_MATRIX_ADDRESSES, MAX_MATRIX_ELEMENTS // origin_step))
+    
+    # Send every block of origins and destinations concurrently over one pooled session
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_API_REQUESTS)
+        session.mount("https://", adapter)
+        
+        with ThreadPoolExecutor(max_workers=MAX_API_REQUESTS) as executor:
+            futures = {
+                (i0, j0): executor.submit(fetch_distance_matrix,
+                                          session,
+                                          base_url,
+                                          origin_addresses[i0:i0 + origin_step],
+                                          destination_addresses[j0:j0 + destination_step],
+                                          departure_time,
+                                          apikey)
+                for i0 in range(0, n, origin_step)
+                for j0 in range(0, m, destination_step)
             }
-
-            response = requests.get(base_url, params=params)
-            if response.status_code == 200:
-                data = response.json()
-
-                # Check if the API returned a valid route
-                if data["status"] == "OK":
-                    duration_seconds = data["routes"][0]["legs"][0]["duration"]["value"]
-                    times_arr[i, j] = duration_seconds  # Store the travel time
-
-                else:
-                    print(f"No valid route for {destination}. \nStatus: {data['status']}")
-            else:
-                raise Exception(f"Google Maps API error: {response.status_code}")
+            
+            for (i0, j0), future in futures.items():
+                data = future.result()
+                
+                for i, row in enumerate(data["rows"], start=i0):
+                    for j, element in enumerate(row["elements"], start=j0):
+                        
+                        # Check if the API returned a valid route
+                        if element["status"] == "OK":
+                            duration_seconds = element["duration"]["value"]
+                            times_arr[i, j] = duration_seconds  # Store the travel time
+                        
+                        else:
+                            print(f"No valid route for {destination_addresses[j]}. \nStatus: {element['status']}")
     
     df_times = pd.DataFrame(data=times_arr, columns=destination_names, index=origin_names)
     
@@ -467,40 +733,26 @@ def get_closest_locations(origin_addresses: list,
         list: A list of strings containing the closest location for each origin-destination pair.
     """
     
-    if not times_df and not apikey:
+    if times_df is None and not apikey:
         raise ValueError("A Google Maps API key is required to calculate the travel times.")
     
-    if not times_df:
+    if times_df is None:
         times_df = time_to_destinations(origin_addresses, origin_names, destination_addresses, destination_names, apikey)
     
-    is_within_time = times_df.values < max_time
-
-    i_arr, j_arr = np.nonzero(is_within_time)
+    # Mask the travel times that are too long so they can never be the closest
+    times_arr = times_df.to_numpy(dtype=float)  # No copy when the times are already floats
+    masked_times = np.where(times_arr < max_time, times_arr, np.inf)
+    if masked_times.shape[0] == 0:  # No origins, so no destination has a closest one
+        return times_df, []
     
-    new_i_list = []
-    new_j_list = []
-
-    # Find the closest location for each origin-destination pair
-    for k in j_arr:
-        
-        same_loc = i_arr[j_arr == k]
-        
-        closest_dist = np.inf
-        
-        for loc in same_loc:
-            if times_df.iloc[loc, k] < closest_dist:
-                closest_dist = times_df.iloc[loc, k]
-                closest_loc = loc
-        
-        new_i_list.append(closest_loc)
-        new_j_list.append(k)
-
-    sort_mask = np.argsort(new_i_list)
-    new_i_arr = np.array(new_i_list)[sort_mask]
-    new_j_arr = np.array(new_j_list)[sort_mask]
+    # Find the closest origin for each destination that has at least one origin within max_time
+    valid_j_arr = np.nonzero(np.isfinite(masked_times).any(axis=0))[0]
+    closest_i_arr = masked_times.argmin(axis=0)[valid_j_arr]
+    
+    # Group the pairs by origin while keeping the destinations in order
+    sort_mask = np.argsort(closest_i_arr, kind='stable')
+    comb_arr = list(zip(closest_i_arr[sort_mask], valid_j_arr[sort_mask]))
     
-    comb_arr = list(map(tuple, np.vstack((new_i_arr, new_j_arr)).T))
-
     closest_locations = []
 
     for i, j in comb_arr:
@@ -530,50 +782,133 @@ def generate_unique_filename(filename, extension):
     return new_filename
 
 
+# File formats save_dataframe can write
+FILE_FORMATS = ("feather", "parquet", "csv")
+
+
+# Helper Function: Check that the library pandas needs to write a file format is installed
+def check_file_format_engine(file_format):
+    """Helper Function: Check that pyarrow, which pandas needs to write Feather and Parquet files, is installed, so a missing engine fails before scraping rather than after."""
+    if file_format in ("feather", "parquet"):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError(f"Saving as {file_format} requires pyarrow. Install it with `pip install pyarrow` or save as CSV.") from None
+
+
+# Helper Function: Save a DataFrame as Feather, Parquet or CSV
+def save_dataframe(df, file_path, file_format, header=True):
+    """Helper Function: Save a DataFrame as Feather, Parquet or CSV.
+    
+    Parquet files are compressed with zstd. CSV files are written with UTF-8 encoding in chunks of rows to bound the memory used while formatting;
+    file_path can also be an open CSV file to append to, with header=False after the first write.
+    """
+    if file_format == "feather":
+        df.to_feather(file_path)
+    elif file_format == "parquet":
+        df.to_parquet(file_path, compression="zstd", index=False)
+    else:
+        df.to_csv(file_path, header=header, index=False, encoding="utf-8", quoting=csv.QUOTE_MINIMAL, lineterminator="\n", chunksize=50_000)
+
+
 # Helper Function
 def wait_for_page_load(browser, timeout=20):   
     """Wait for the page to load by checking the document.readyState.""" 
-    WebDriverWait(browser, timeout).until(
+    WebDriverWait(browser, timeout, poll_frequency=WAIT_POLL_FREQUENCY).until(
         lambda x: x.execute_script("return document.readyState") == "complete"
     )
 
 
-# Helper Function
-def find_element_by_text(text, tag='li', browser=None, wait=None, timeout=20):
-    """
-    Find an element by its text content.
+# Columns of the DataFrame returned by product_scraper
+PRODUCT_COLUMNS = ['Store Name', 'Category', 'Product Name', 'Price', 'Rating', 'Number of Reviews', 'Calories']
+
+# Types of the numeric product columns, with nullable integers for the calories many products do not list
+PRODUCT_DTYPES = {'Price': 'float64', 'Rating': 'float32', 'Number of Reviews': 'int32', 'Calories': 'Int32'}
+
+
+# Helper Function: Convert a column of price texts to floats adjusted for delivery markup
+def convert_prices(price_texts):
+    """Helper Function: Convert a Series of price texts like "USD 1.00", "$1.00" or "MX$1.00" to floats adjusted for delivery markup."""
+    # Strip the price indicator at the start of each price
+    prices = price_texts.str.replace(PRICE_PREFIX_RE, "", regex=True).astype(float)
     
-    Args:
-        text (str): The text content to look for.
-        tag (str): The tag name to filter (default is 'li').
-        browser (webdriver): The browser instance to use.
-        wait (WebDriverWait): The WebDriverWait instance.
-        timeout (int): Timeout period for waiting.
+    # Adjust for inflated delivery prices (ranges from 10-30% depending on the store so assume 20%)
+    return (prices / 1.2).round(2)
+
+
+# JavaScript to read the title and price spans (matching the pattern in arguments[0]) of every menu category in a single round trip to the browser
+MENU_CATEGORIES_JS = """
+const priceRe = new RegExp(arguments[0]);
+return Array.from(document.getElementsByTagName('li'))
+    .filter(li => li.getElementsByTagName('h3').length > 0)
+    .map(li => {
+        const spans = Array.from(li.getElementsByTagName('span')).map(e => e.innerText.trim());
+        return {
+            h3: li.getElementsByTagName('h3')[0].innerText.trim(),
+            // Each price with the span before it (the product name) and the four after it (reviews and calories)
+            products: spans.flatMap((text, i) => priceRe.test(text) ? [[i > 0 ? spans[i - 1] : null, ...spans.slice(i, i + 5)]] : [])
+        };
+    });
+"""
 
-    Returns:
-        WebElement or None: The found element or None if not found.
-    """
-    # Construct an XPath expression to find the tag with the specific text
-    xpath = f"//{tag}[text()='{text}']"
 
-    # Wait until the desired element is located or time out
+# Browsers shared by the calls to extract_product_info that are not given one, keyed by headless
+shared_browsers = {}
+
+
+# Helper Function: Get the process's shared browser, starting it on first use
+def get_shared_browser(headless):
+    """Helper Function: Get the process's shared browser for the headless setting, starting it on first use or replacing it if it has crashed or been quit."""
+    browser = shared_browsers.get(headless)
+    if browser is not None:
+        try:
+            browser.title  # Cheap command to check the session still works
+            return browser
+        except WebDriverException:
+            quit_browser(browser)
+    
+    browser = shared_browsers[headless] = start_browser(chrome_options(headless))
+    atexit.register(quit_browser, browser)  # Runs before the chromedriver service is stopped
+    return browser
+
+
+# Helper Function: Quit a browser, ignoring one that has already crashed or been quit
+def quit_browser(browser):
+    """Helper Function: Quit a browser, ignoring one that has already crashed or been quit."""
     try:
-        element = wait.until(EC.presence_of_element_located((By.XPATH, xpath)))
-        return element
-    except Exception as e:
-        print(f"Element with text '{text}' not found. Error: {e}")
-        return None
+        browser.quit()
+    except WebDriverException:
+        pass
 
 
 # Extract information about a product from a store page
-def extract_product_info(url, store_name, headless):
-    """Extract information about a product from a store page."""
+def extract_product_info(url, store_name, headless, browser=None):
+    """Extract information about a product from a store page.
     
-    options = Options()
-    if headless:
-        options.add_argument("--headless")
-        
-    browser = webdriver.Chrome(options=options)
+    If a browser is given it is reused and left open for the caller's next page,
+    otherwise the process's shared browser is used, so repeated calls skip Chrome's start-up.
+    """
+    
+    if browser is None:
+        browser = get_shared_browser(headless)
+    browser.delete_all_cookies()  # Start the store page from a clean session
+    
+    return extract_menu_products(browser, url, store_name)
+
+
+# Helper Function: Parse the calories of a product
+def parse_calories(text):
+    """Helper Function: Parse calories like "1,200 Cal." to an int, or None if the text is not a calorie count, such as a badge."""
+    calories_match = CALORIES_RE.match(text)
+    return int(calories_match['cal'].replace(',', '')) if calories_match else None
+
+
+# Helper Function: Extract the products from a store page with an open browser
+def extract_menu_products(browser, url, store_name):
+    """Helper Function: Extract the products from a store page with an open browser.
+    
+    Prices are kept as the page's text, see convert_prices.
+    """
     browser.get(url)
     
     try:
@@ -581,146 +916,183 @@ def extract_product_info(url, store_name, headless):
     except:
         print("Page load failed. Trying again...")
             
-    li_elements = browser.find_elements(By.TAG_NAME, "li")
+    # Read every category that contains food items all at once
+    menu_categories = browser.execute_script(MENU_CATEGORIES_JS, PRICE_RE.pattern)
     
-    product_info_list = []
-    product_names = []
-    product_prices = []
+    product_info = {column: [] for column in PRODUCT_COLUMNS}  # One list per column
+    seen_products = set()  # (product name, price) pairs already found
     
-    for li_elt in li_elements:  # Loop through each category
-        if (li_elt.find_elements(By.TAG_NAME, "h3")  # Check if it contains food items and is not Featured Items
-            and li_elt.find_elements(By.TAG_NAME, "h3")[0].text != "Artículos destacados" 
-            and li_elt.find_elements(By.TAG_NAME, "h3")[0].text != "Featured items"):
+    for menu_category in menu_categories:  # Loop through each category
+        category = menu_category['h3']
+        if category != "Artículos destacados" and category != "Featured items":  # Check it is not Featured Items
             
-            category = li_elt.find_elements(By.TAG_NAME, "h3")[0].text
-            
-            # Locate all matching elements using Selenium's find_elements
-            span_elements = li_elt.find_elements(By.TAG_NAME, "span")
-            price_pattern = r"^(USD ?|\$ ?|MX\$ ?)\d+\.\d{2}$"
-            review_pattern = r" \d+% \((\d+)\)"
-                        
-            for index, element in enumerate(span_elements):
-                price = element.text
+            for product_name, price, *following in menu_category['products']:
                 calories = None
                 rating_percentage = None
                 num_reviews = 0
                 
-                # Check if the current text begins with a price indicator like "USD", "$", or "MX$"
-                if not re.match(price_pattern, price):  # Check if the str matches the price pattern
-                                        
-                    # Convert price to float
-                    # Adjust for inflated delivery prices (ranges from 10-30% depending on the store so assume 20%)
-                    if price.startswith("USD "): 
-                        price = round(float(price[4:]) / 1.2, 2)
-                    elif price.startswith("$"):
-                        price = round(float(price[1:]) / 1.2, 2)
-                    else:
-                        price = round(float(price[3:]) / 1.2, 2)
-                                            
-                    # Get the previous element's text (if it exists)
-                    product_name = span_elements[index - 1].text if index > 0 else None
-                    
-                    # Avoid duplicate products 
-                    if product_name in product_names:  # Skip if product name and price match 
-                        index = product_names.index(product_name)
-                        if price == product_prices[index]:
-                            continue
-                    
-                    product_names.append(product_name)
-                    product_prices.append(price)
-                        
-
-                    # Check if the next element is ' • \n'
-                    if index + 1 < len(span_elements) and span_elements[index + 1].text.strip() == '•':
+                # Avoid duplicate products 
+                if (product_name, price) in seen_products:  # Skip if product name and price match 
+                    continue
+                seen_products.add((product_name, price))
                         
-                        if not re.match(review_pattern, span_elements[index + 2].text):
-                            rating_percentage = None
-                            num_reviews = 0
-                            calories = int(span_elements[index + 2].text.split()[0])
-                        else:
-                            # Get the next-next element's text
-                            reviews = span_elements[index + 2].text if index + 2 < len(span_elements) else None
-
-                            # Parse the reviews text
-                            reviews_split = reviews.split()
-                            rating_percentage = float(reviews_split[0][:-1])
-                            num_reviews = int(reviews_split[1][1:-1])
-                            
-                            if index + 3 < len(span_elements) and span_elements[index + 3].text.strip() == '•':
-                                calories = int(span_elements[index + 4].text.split()[0])
+                # Check if the next element is ' • \n'
+                if len(following) >= 2 and following[0] == '•':
                         
-                        product_info_list.append([store_name, category, product_name, price, rating_percentage, num_reviews, calories])
+                    review_match = REVIEW_RE.match(following[1])
+                    if not review_match:
+                        calories = parse_calories(following[1])
                     else:
-                        product_info_list.append([store_name, category, product_name, price, None, 0, None])
-                                            
-    browser.quit()
+                        # Parse the reviews text
+                        rating_percentage = float(review_match['pct'])
+                        num_reviews = int(review_match['n'].replace(',', ''))
+                            
+                        if len(following) >= 4 and following[2] == '•':
+                            calories = parse_calories(following[3])
+                
+                for column, value in zip(PRODUCT_COLUMNS, (store_name, category, product_name, price, rating_percentage, num_reviews, calories)):
+                    product_info[column].append(value)
             
-    return product_info_list
+    return product_info
 
 
-# Helper Function: Set up the browser for the extraction phase
-def setup_extraction(search_query, location, headless):
-    """Helper Function: Set up the browser for the extraction phase."""
+# Approximate memory used by one Chrome browser scraping stores, in bytes
+BROWSER_MEMORY = 1.5 * 1024**3
+
+
+# Helper Function: Get the number of browser workers the machine can run at once
+def max_browser_workers(max_tasks):
+    """Helper Function: Get the number of browser workers to run at once, capped by the CPU count, the available memory (if psutil is installed) and the number of tasks."""
+    num_workers = min(max_tasks, os.cpu_count() or 1)
+    if psutil is not None:
+        num_workers = min(num_workers, int(psutil.virtual_memory().available // BROWSER_MEMORY))
+    return max(1, num_workers)
+
+
+# Helper Function: Scrape a chunk of stores with a single browser
+def scrape_store_chunk(stores, headless):
+    """Helper Function: Scrape a chunk of (store name, store URL) pairs with a single browser, returning the products of each store.
     
-    # Initialize a `tqdm` object with a total of 10
-    setup_bar = tqdm(total=4, desc="Setting up the browser...")
-            
-    # Set up the browser
-    options = Options()
-    if headless:
-        options.add_argument("--headless")
+    The chunk runs in a worker process, which exits without running atexit handlers, so the browser gets
+    its own chromedriver service that quitting the browser stops, rather than the shared one.
+    """
+    browser = webdriver.Chrome(service=chromedriver_service(), options=chrome_options(headless))
+    try:
+        chunk_results = []
+        for store_name, store_url in stores:
+            try:
+                chunk_results.append(extract_product_info(store_url, store_name, headless, browser=browser))
+            except Exception as e:  # Keep the rest of the chunk when one store fails
+                print(f"Error extracting products for {store_name} ({store_url}). Error: {e}")
+                chunk_results.append({})
+        return chunk_results
+    finally:
+        browser.quit()
+
+
+# Helper Function: Log the stores found on the search results page
+def log_stores(stores, debug_mode):
+    """Helper Function: Log the stores found at DEBUG level, printing them to stderr for this call only if debug_mode is set.
     
-    browser = webdriver.Chrome(options=options)
-    wait = WebDriverWait(browser, 20)
-    english = True
-
-    # Get the website URL from the environment variables
-    # NOTE: You need to set the WEBSITE_URL environment variable to the website you want to scrape. 
-    # To do this create a .env file in the same directory as this script and add the line:
-    # WEBSITE_URL="https://www.yourwebsite.com"
-    load_dotenv()
-    website_url = os.getenv("WEBSITE_URL")
+    Without debug_mode the messages follow the caller's own logging configuration.
+    """
+    previous_level = log.level
+    handler = None
+    if debug_mode:  # Show the debug messages below
+        log.setLevel(logging.DEBUG)
+        if not log.handlers:
+            handler = logging.StreamHandler()
+            log.addHandler(handler)
+    
+    try:
+        log.debug("Number of Stores: %s", len(stores))
+        for store_name, store_url in stores:
+            log.debug("Store %s -> %s", store_name, store_url)
+    finally:  # Leave the logger as the caller configured it
+        log.setLevel(previous_level)
+        if handler:
+            log.removeHandler(handler)
+
+
+# JavaScript that fills an input with arguments[1] as a single edit: the native value setter keeps the page's
+# framework in sync, and one "input" event replaces the key events `send_keys` would send for each character
+SET_INPUT_JS = """
+const [input, value] = arguments;
+input.focus();
+Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set.call(input, value);
+input.dispatchEvent(new Event('input', {bubbles: true}));
+"""
 
-    # Open the specific website
-    browser.get(website_url)
 
-    # Check if the page is in English or Spanish
-    search_bar = browser.find_element(By.XPATH, '//*[@role="combobox"]')
-    placeholder = search_bar.get_attribute('placeholder')
-    if placeholder == "Ingresa la dirección de entrega":
-        english = False
+# Helper Function: Build the products DataFrame from the products of several stores
+def products_dataframe(store_results):
+    """Helper Function: Build the products DataFrame, with converted prices and typed columns, from the products of several stores."""
+    columns = defaultdict(list)
+    for result in store_results:
+        for column, values in result.items():
+            columns[column].extend(values)
+    
+    products_df = pd.DataFrame(columns, columns=PRODUCT_COLUMNS)
+    products_df['Price'] = convert_prices(products_df['Price'])
+    return products_df.astype(PRODUCT_DTYPES)
 
-    setup_bar.update(1)
 
+# Helper Function: Open a CSV file to stream products into, writing its header
+def open_products_csv(file_path):
+    """Helper Function: Open a CSV file to stream products into, writing its header.
+    
+    Falls back to a unique file name if the file cannot be opened, e.g. because it is open in another program.
+    """
+    try:  # Handle cases when it might overwrite a file
+        csv_file = open(file_path, "w", encoding="utf-8", newline="")
+    except OSError as e:
+        print(f"Error saving all store information to csv: {e}")
+        file_path = generate_unique_filename(file_path, ".csv")
+        csv_file = open(file_path, "w", encoding="utf-8", newline="")
+        print(f"Saving with file name: {file_path}")
+    save_dataframe(products_dataframe([]), csv_file, "csv")
+    return csv_file
+
+
+# Helper Function: Enter the delivery location on the website's home page
+def enter_location(browser, wait, location):
+    """Helper Function: Enter the delivery location on the website's home page and wait for the stores near it."""
+    
     # Search bar for the location
-    wait.until(EC.presence_of_element_located((By.XPATH, '//*[@role="combobox"]')))
+    wait.until(EC.presence_of_element_located(COMBOBOX_LOC))
         
     # Using XPath to select elements based on the role attribute
-    combobox_elements = browser.find_elements(By.XPATH, '//*[@role="combobox"]')
+    combobox_elements = browser.find_elements(*COMBOBOX_LOC)
 
     # Access the first found combobox element
     if combobox_elements:
-        search_bar = combobox_elements[0]
+        search_bar = wait.until(EC.element_to_be_clickable(combobox_elements[0]))
         
-        # Input the search term into the search bar
-        search_bar.send_keys(location)
-        time.sleep(1)
+        # Input the location into the search bar
+        browser.execute_script(SET_INPUT_JS, search_bar, location)
+        
+        # Wait for the address suggestions so "Enter" picks one
+        try:
+            WebDriverWait(browser, 10).until(EC.presence_of_element_located(OPTION_LOC))
+        except TimeoutException:
+            pass  # Submit the typed address as is
         
         # Press "Enter" to trigger the search
         search_bar.send_keys(Keys.RETURN)
     else:
         raise Exception("First search bar not found.")
 
-    # Wait for the page to load
-    # TODO: Find a more robust way to wait for the page to load
-    time.sleep(3)
+    # Wait for the stores near the location to load
     wait_for_page_load(browser)
-    time.sleep(3)
-    
-    setup_bar.update(1)
+    wait.until(EC.presence_of_element_located(STORE_CARD_LOC))
+
+
+# Helper Function: Search the restaurants near the entered location
+def enter_search_query(browser, wait, search_query):
+    """Helper Function: Search the restaurants near the entered location and wait for the results."""
 
     # Second search bar for the search term
-    combobox_elements = browser.find_elements(By.XPATH, '//*[@role="combobox"]')
+    combobox_elements = browser.find_elements(*COMBOBOX_LOC)
     span_elements = browser.find_elements(By.TAG_NAME, 'span')
 
     # Access the first found combobox element
@@ -729,51 +1101,147 @@ def setup_extraction(search_query, location, headless):
         
         # Input the search term into the search bar
         search_bar.click()
-        time.sleep(1)
     elif span_elements:  # Handles the case where the search bar is not a combobox
         search_bar = span_elements[0]
         
         # Input the search term into the search bar
         search_bar.click()
-        time.sleep(1)
     else:
         raise Exception("Second search bar not found.")
 
-    # Search for restaurants
-    if english:  # Check if the language is set to English
-        restaurant_tab = find_element_by_text('Restaurants', tag='li', browser=browser, wait=wait)
-    else:
-        restaurant_tab = find_element_by_text('Restaurantes', tag='li', browser=browser, wait=wait)
+    # Search for restaurants, whether the page is in English or Spanish
+    try:
+        wait.until(EC.element_to_be_clickable(RESTAURANT_TAB_LOC)).click()
+    except TimeoutException as e:
+        print(f"Restaurants tab not found. Error: {e}")
+
+    # Input the search term into the search bar, replacing any earlier search
+    search_bar = wait.until(EC.element_to_be_clickable(COMBOBOX_LOC))
+    browser.execute_script(SET_INPUT_JS, search_bar, search_query)
+    current_url = browser.current_url
+    search_bar.send_keys(Keys.RETURN)
+
+    # Wait for the search results, whose store cards replace the ones shown before
+    wait.until(EC.url_changes(current_url))
+    wait_for_page_load(browser)
+    wait.until(EC.presence_of_element_located(STORE_CARD_LOC))
 
-    if restaurant_tab:
-        restaurant_tab.click()
-        time.sleep(1)
 
-    # Input the search term into the search bar
-    search_bar = browser.find_element(By.XPATH, '//*[@role="combobox"]')
-    search_bar.send_keys(search_query)
-    search_bar.send_keys(Keys.RETURN)
+# Browsers kept on the search results by setup_extraction when asked to, keyed by their profile directory, so the next search in a location skips entering it
+location_browsers = {}
+
+
+# Helper Function: Set up the browser for the extraction phase
+def setup_extraction(search_query, location, headless, keep_browser=False):
+    """Helper Function: Set up the browser for the extraction phase.
+    
+    A browser kept by an earlier call for the same location is reused, which only runs the new search.
+    With keep_browser the browser is kept for the next call, until quit_browsers or the program exits.
+    """
     
-    setup_bar.update(1)
+    # Initialize a `tqdm` object with a total of 4
+    setup_bar = tqdm(total=4, desc="Setting up the browser...")
+    
+    # Reuse the browser of an earlier search in this location, starting over if it fails
+    profile_dir = chrome_profile_dir(location, headless)
+    browser = location_browsers.pop(profile_dir, None)
+    if browser is not None:
+        setup_bar.update(2)
+        try:
+            enter_search_query(browser, WebDriverWait(browser, 20, poll_frequency=WAIT_POLL_FREQUENCY), search_query)
+        except Exception as e:
+            print(f"Reusing the browser for {location} failed, starting a new one. Error: {e}")
+            quit_browser(browser)
+            browser = None
+            setup_bar.reset()
+    
+    if browser is None:
+        # Set up the browser, reusing the profile of earlier runs for this location
+        browser = start_browser(chrome_options(headless, user_data_dir=profile_dir))
+        atexit.register(quit_browser, browser)  # Runs before the chromedriver service is stopped
+        wait = WebDriverWait(browser, 20, poll_frequency=WAIT_POLL_FREQUENCY)
 
-    time.sleep(3)
-    wait_for_page_load(browser)
+        try:
+            # Open the specific website
+            browser.get(WEBSITE_URL)
+            setup_bar.update(1)
+
+            # The profile may remember the location from an earlier run, opening on the stores near it
+            wait_for_page_load(browser)
+            if not browser.find_elements(*STORE_CARD_LOC):
+                enter_location(browser, wait, location)
+            setup_bar.update(1)
+
+            enter_search_query(browser, wait, search_query)
+        except Exception:
+            # Release the location's profile so the next call can start over
+            quit_browser(browser)
+            setup_bar.close()
+            raise
     
-    setup_bar.update(1)
+    setup_bar.update(2)
     setup_bar.close()
     
-    return browser 
+    if keep_browser:
+        location_browsers[profile_dir] = browser
+    return browser
+
+
+# Helper Function: Quit the browsers kept open for later searches
+def quit_browsers():
+    """Helper Function: Quit the browsers kept open for later searches by setup_extraction and extract_product_info, instead of waiting for the program to exit."""
+    for browsers in (location_browsers, shared_browsers):
+        while browsers:
+            quit_browser(browsers.popitem()[1])
+
+
+# JavaScript to read the name and URL of the first arguments[0] unique store cards on the search results page
+STORES_JS = """
+const maxStores = arguments[0];
+const seenUrls = new Set();
+const stores = [];
+for (const a of document.querySelectorAll('a[data-testid="store-card"]')) {
+    if (stores.length >= maxStores) {
+        break;
+    }
+    if (!a.href || seenUrls.has(a.href)) {  // Skip cards without a link, which would waste a browser
+        continue;
+    }
+    
+    // The name is inside the card link on some page layouts and next to it on others,
+    // so look up the ancestors that belong to this card alone, before they hold other store cards
+    let h3 = a.querySelector('h3');
+    for (let e = a.parentElement; !h3 && e && e.querySelectorAll('a[data-testid="store-card"]').length === 1; e = e.parentElement) {
+        h3 = e.querySelector('h3');
+    }
+    const name = h3 ? h3.innerText.trim() : '';
+    if (name) {
+        seenUrls.add(a.href);
+        stores.push([name, a.href]);
+    }
+}
+return stores;
+"""
 
 
 # Define the main function to scrape the prices, ratings, and calories of food products based on a search query and location
-def product_scraper(search_query, location, max_stores=50, filename=None, headless=True, debug_mode=False):
+def product_scraper(search_query, location, max_stores=50, filename=None, headless=True, debug_mode=False, num_workers=4, file_format=None, keep_browser=False):
     """Scrape the prices, ratings, and calories of food products based on a search query and location.
     
     Parameters:
         search_query (str): The search query to look for.
         location (str): The location to search in.
-        filename (str): The name of the file to store the data in as CSV.
+        filename (str): The name of the file to store the data in. Saved in the format of its extension
+            (".feather", ".parquet" or ".csv"), otherwise as Feather (requires pyarrow), which is much faster to write and read back.
+            CSV files are written as each worker finishes its stores, so their rows are in the order the workers finish.
         headless (bool): Whether to run the browser in headless mode.
+        debug_mode (bool): Whether to log the stores found at DEBUG level to stderr. Default is False.
+        num_workers (int): The maximum number of browsers scraping stores at once, each in its own process.
+            Lowered further if the machine does not have the CPUs or memory for them. Default is 4.
+        file_format (str): The format to save the file in, "feather", "parquet" (requires pyarrow) or "csv",
+            overriding the filename's extension. Default is None.
+        keep_browser (bool): Whether to keep the browser used to search open, so later searches in the same location
+            skip entering it. Each kept browser uses memory until quit_browsers() is called. Default is False.
     
     Returns:
         pandas.DataFrame: A DataFrame containing the information about the products found.
@@ -786,96 +1254,85 @@ def product_scraper(search_query, location, max_stores=50, filename=None, headle
     # Check the input parameters
     if max_stores < 1:
         raise ValueError("max_stores must be greater than 0.")
-    if type(search_query) != str:
+    if num_workers < 1:
+        raise ValueError("num_workers must be greater than 0.")
+    if not WEBSITE_URL:
+        raise ValueError("WEBSITE_URL is not set. Add WEBSITE_URL=\"https://www.yourwebsite.com\" to the .env file.")
+    if not isinstance(search_query, str):
         raise TypeError("search_query must be a string.")
-    if type(location) != str:
+    if not isinstance(location, str):
         raise TypeError("location must be a string.")
     if filename:
-        if filename.split(".")[-1] == "csv":
-            filename = ".".join(filename.split(".")[:-1])
+        base, ext = os.path.splitext(filename)
+        if ext[1:] in FILE_FORMATS:
+            filename = base
+            file_format = file_format or ext[1:]
+    file_format = file_format or "feather"
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"file_format must be one of {FILE_FORMATS}.")
+    if filename:
+        check_file_format_engine(file_format)
     
     # Set up the browser for the extraction phase
-    browser = setup_extraction(search_query, location, headless)
+    browser = setup_extraction(search_query, location, headless, keep_browser)
     
     # TODO: Add feature for multiple search queries HERE.
     # For multiple locations, call the function multiple times with different locations. 
     
     # Begin the extraction phase
-    store_names = []  # Store previous store names to avoid duplicates
-    all_stores_info_list = []  # Store all store information
+    # Get the (name, URL) pairs of the first max_stores unique stores, in page order, in a single round trip to the browser
+    stores = browser.execute_script(STORES_JS, max_stores)
+    max_stores = len(stores)
 
-    # Get the list of stores to get the number of stores to iterate through
-    stores_list = browser.find_elements(By.TAG_NAME, 'h3')
-    
-    if len(stores_list) < max_stores:
-        max_stores = len(stores_list)
-        
-    # Get store names all at once by checking h3 elements    
-    for store in stores_list:
-        name = store.text
-        if name != "" and name not in store_names:
-            store_names.append(name)
-    
-    xpath_expression = '//a[@data-testid="store-card"]'
-    store_urls_list = browser.find_elements(By.XPATH, xpath_expression)
-    store_urls = []
-
-    # Get the store URLs
-    for store in store_urls_list:
-        store_url = store.get_attribute('href')
-        if store_url not in store_urls:
-            store_urls.append(store_url)
-
-    if debug_mode:  # Debugging store names and urls
-        print(f"Number of Store names: {len(store_names)}")
-        print(f"Number of Store URLs: {len(store_urls)}")
-        
-        for i in range(len(store_names)):  # Loop through each store
-            print(f"Store Name: {store_names[i]}")
-            print(f"Store URL: {store_urls[i]}")
-            
-    if len(store_names) != len(store_urls):  # Debugging the store names and URLs
-        print(f"Number of store names and URLs do not match: {len(store_names), len(store_urls)}")
-        
-        try:
-            for i in range(len(store_names)):  # Loop through each store
-                print(f"Store Name: {store_names[i]}")
-                print(f"Store URL: {store_urls[i]}")
-                print("______________")
-        except Exception as e:
-            print(f"Error printing store names and URLs: {e}")
-        print("store names: ", store_names)
-        print("store urls: ", store_urls)
-    
-    # Wrap extract_product_info with Dask's delayed
-    extract_product_info_dask = delayed(extract_product_info)
+    # Debugging store names and urls
+    log_stores(stores, debug_mode)
     
-    # Create a list of delayed tasks
-    tasks = [extract_product_info_dask(store_urls[i], store_names[i], headless) for i in range(max_stores)]
+    # Split the stores into one chunk per worker so each worker starts a single browser
+    num_workers = max_browser_workers(min(num_workers, max_stores))
+    chunks = [range(i, max_stores, num_workers) for i in range(min(num_workers, max_stores))]
     
-    # Compute the tasks in parallel
-    with ProgressBar():
-        results = compute(*tasks, scheduler='processes')
+    # Stream CSV files as each chunk finishes, so a failure late in the scrape keeps the stores already scraped
+    file_path = f"pricing files/{filename}.{file_format}" if filename else None
+    csv_file = open_products_csv(file_path) if file_path and file_format == "csv" else None
     
-    # Aggregate results
-    for result in results:
-        all_stores_info_list.extend(result)
+    # Scrape the chunks in parallel processes, reporting progress as each chunk finishes
+    results = [{} for _ in range(max_stores)]
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor, \
+                tqdm(total=max_stores, desc="Scraping stores", unit="store") as stores_bar:
+            futures = {executor.submit(scrape_store_chunk, [stores[i] for i in chunk], headless): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                stores_bar.update(len(chunk))
+                try:
+                    chunk_results = future.result()
+                except Exception as e:  # Keep streaming the other chunks, e.g. when a worker's browser failed to start
+                    print(f"Error scraping the stores {[stores[i][0] for i in chunk]}. Error: {e}")
+                    continue
+                for i, result in zip(chunk, chunk_results):
+                    results[i] = result
+                if csv_file:
+                    save_dataframe(products_dataframe(chunk_results), csv_file, "csv", header=False)
+                    csv_file.flush()
+    finally:
+        if csv_file:
+            csv_file.close()
                     
-    # Create a DataFrame from the product info
-    all_stores_df = pd.DataFrame(all_stores_info_list, columns=['Store Name', 'Category', 'Product Name', 'Price', 'Rating', 'Number of Reviews', 'Calories'])
+    # Create a DataFrame from the product info of every store, in store order
+    all_stores_df = products_dataframe(results)
 
-    if filename:
+    if file_path and not csv_file:
         try:  # Handle cases when it might overwrite a file
-            # Save the DataFrame to a CSV file with UTF-8 encoding
-            all_stores_df.to_csv(f"pricing files/{filename}.csv", index=False, encoding="utf-8")
-        except Exception as e:
-            print(f"Error saving all store information to CSV: {e}")
-            new_filename = generate_unique_filename(f"pricing files/{filename}.csv", ".csv")
-            all_stores_df.to_csv(f"pricing files/{new_filename}.csv", index=False, encoding="utf-8")
+            save_dataframe(all_stores_df, file_path, file_format)
+        except OSError as e:
+            print(f"Error saving all store information to {file_format}: {e}")
+            new_filename = generate_unique_filename(file_path, f".{file_format}")
+            save_dataframe(all_stores_df, new_filename, file_format)
             print(f"Saved with file name: {new_filename}")
             
-    # Close the browser
-    browser.quit()
+    # Close the browser, unless it is kept for the next search in this location
+    if not keep_browser:
+        browser.quit()
 
     return all_stores_df
 